@@ -1,23 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import aiohttp
 import logging
-from typing import Optional, Dict, List
-import json
-import traceback
+from typing import Optional, Dict, List, Tuple
+import orjson
+import gzip
 import os
 from aiohttp import ClientTimeout
 from aiohttp.client_exceptions import ClientError
 import asyncio
-from fastapi.responses import JSONResponse
-from datetime import datetime, timedelta
-import requests
-from bs4 import BeautifulSoup
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.responses import ORJSONResponse, Response
+from selectolax.lexbor import LexborHTMLParser
 import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from cachetools import TTLCache
 
-# Enhanced logging
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed when REDIS_URL is set
+    aioredis = None
+
+# Logging level comes from the environment; formatting below is lazy so dropped records cost nothing
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -25,15 +35,109 @@ logger = logging.getLogger(__name__)
 # Cache settings
 CACHE_DURATION = 300  # 5 minutes instead of 30 seconds
 CACHE_FALLBACK_DURATION = 24 * 60 * 60  # 24 hours for fallback when API is down
-token_cache = {
-    "data": None,
-    "last_updated": None
-}
+PRESERIALIZED_LIMITS = (100, 500, 1000)  # Response sizes encoded to JSON once per refresh
+MAX_CACHED_PAYLOADS = 32  # Other sizes are encoded on first request, up to this many per refresh
+WARM_LIMIT = 1000  # The background refresher scrapes the largest /tokens limit so every request is a slice
+REFRESH_AHEAD = 30  # Seconds before the cached list expires that the refresher scrapes again
+REFRESH_RETRY_DELAY = 10  # Minimum pause between refresher runs, so failures don't turn into a busy loop
+REFRESH_JITTER = 5  # Random extra seconds per sleep so workers holding the same shared copy don't wake together
+GZIP_MINIMUM_SIZE = 1024  # Smaller responses aren't worth compressing
+GZIP_LEVEL = 5  # Keeps most of the ratio of level 9 at a fraction of the CPU
+TOKEN_DETAILS_CACHE_SIZE = 10_000  # Scraped token pages kept in memory, least recently used evicted first
+TOKEN_DETAILS_DURATION = 300  # 5 minutes, same as the board list
+TOKEN_NOT_FOUND_DURATION = 60  # Shorter memory for 404s so newly launched tokens show up quickly
+
+# Optional token list shared by all workers, enabled by pointing REDIS_URL at a Redis server
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_TIMEOUT = 1  # Seconds per connect and per command; a stuck Redis then counts as a miss instead of a hang
+REDIS_TOKENS_KEY = "pf:tokens:v1"  # Expires after CACHE_DURATION
+REDIS_TOKENS_FALLBACK_KEY = "pf:tokens:v1:fallback"  # Expires after CACHE_FALLBACK_DURATION
+REDIS_TOKENS_LOCK_KEY = "pf:tokens:v1:lock"  # Held by the worker whose refresher is scraping, expires after REFRESH_AHEAD
+REDIS_TOKEN_KEY_PREFIX = "pf:token:v1:"  # + address, expires after TOKEN_DETAILS_DURATION
+REDIS_TOKEN_FALLBACK_KEY_PREFIX = "pf:token:v1:fallback:"  # + address, expires after CACHE_FALLBACK_DURATION
+
+@dataclass(slots=True)
+class TokenRow:
+    """One scraped board token; slotted to keep the cached list compact, and encoded natively by orjson"""
+    name: str
+    price: float
+    market_cap: float
+    description: str
+    image_url: str
+    token_url: str
+    mint: str
+    supply: str = "1,000,000,000"
+    replies: int = 0  # We don't have this information from scraping
+
+class TokenCache:
+    """Scraped token list shared by all requests, refreshed by one coroutine at a time"""
+
+    def __init__(self):
+        self.data = None
+        # Same rows keyed by mint address for O(1) lookups from /token/{token_address}
+        self.by_mint = {}
+        # Ready-to-send JSON bytes of data[:n], keyed by n
+        self.payloads = {}
+        # Gzipped copies of payloads, compressed on first use for clients that accept gzip
+        self.gzipped_payloads = {}
+        # Validator of the board page the data was scraped from, sent back as If-None-Match
+        self.etag = None
+        # time.monotonic() of the last successful scrape, immune to wall-clock adjustments
+        self.last_updated = 0.0
+        # Largest limit scraped so far; smaller limits are served by slicing the cached list
+        self.max_limit = 0
+        self.lock = asyncio.Lock()
+        # Cleared while a refresh is in flight; concurrent callers wait on it instead of scraping again
+        self.refreshing = asyncio.Event()
+        self.refreshing.set()
+        # Reference to the stale-while-revalidate refresh so it isn't garbage collected mid-flight
+        self.refresh_task = None
+
+    def covers(self, limit: int) -> bool:
+        """Whether the cached list was scraped with at least `limit` tokens"""
+        return self.data is not None and limit <= self.max_limit
+
+    def is_fresh(self, limit: int, now: float) -> bool:
+        """Whether the cached list covers `limit` and is younger than CACHE_DURATION"""
+        # Runs on every cache hit, so covers() is inlined: max_limit stays 0 until a list is stored
+        return limit <= self.max_limit and now - self.last_updated < CACHE_DURATION
+
+    def store(self, data: List[TokenRow], limit: int, etag: Optional[str] = None):
+        """Replace the cached list, re-encoding the common response sizes once for all cache hits"""
+        self.data = data
+        self.by_mint = {token.mint: token for token in data}
+        self.etag = etag
+        self.payloads = {n: orjson.dumps(data[:n]) for n in PRESERIALIZED_LIMITS if n <= limit}
+        self.gzipped_payloads = {}
+        self.last_updated = time.monotonic()
+        self.max_limit = limit
+
+    def payload(self, limit: int) -> bytes:
+        """JSON bytes of data[:limit], encoded on first use and reused until the next store()"""
+        payload = self.payloads.get(limit)
+        if payload is None:
+            payload = orjson.dumps(self.data[:limit])
+            # Bounded so arbitrary limits can't pin up to 1000 copies of the list in memory
+            if len(self.payloads) < MAX_CACHED_PAYLOADS:
+                self.payloads[limit] = payload
+        return payload
+
+    def gzipped_payload(self, limit: int) -> bytes:
+        """payload(limit) compressed once per refresh, instead of by the middleware on every response"""
+        gzipped = self.gzipped_payloads.get(limit)
+        if gzipped is None:
+            gzipped = gzip.compress(self.payload(limit), compresslevel=GZIP_LEVEL, mtime=0)
+            if len(self.gzipped_payloads) < MAX_CACHED_PAYLOADS:
+                self.gzipped_payloads[limit] = gzipped
+        return gzipped
+
+token_cache = TokenCache()
 
 app = FastAPI(
     title="Pump.fun API Scraper",
     description="API for scraping pump.fun data including tokens, marketcap, trades, and more",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -43,376 +147,630 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser clients read whether /token served a stale copy
+    expose_headers=["X-Cache"],
 )
 
+# Compress larger responses; token lists are repetitive JSON and shrink several times over.
+# Cached /tokens payloads arrive already gzipped and are passed through untouched
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_LEVEL)
+
 # Replace the API_URL with direct website URLs
 # API_URL = "https://frontend-api.pump.fun"
 WEBSITE_URL = "https://pump.fun"
+BOARD_URL = f"{WEBSITE_URL}/board"
+TOKEN_URL_PREFIX = f"{BOARD_URL}/"
+
+# Labelled values on a token page, matched against the raw HTML bytes (tags may sit between label and value)
+# Values must start with a digit so stray punctuation after a label ("Market Cap.") isn't taken as the value
+MARKET_CAP_HTML_RE = re.compile(rb'Market Cap(?:[:\s]|<[^>]*>)*\$?\s*(\d[\d,]*(?:\.\d+)?)')
+HOLDERS_HTML_RE = re.compile(rb'Holders(?:[:\s]|<[^>]*>)*(\d[\d,]*)')
+# Same labels matched against the extracted page text, used when the raw HTML layout defeats the above
+MARKET_CAP_TEXT_RE = re.compile(r'Market Cap[:\s]*\$?\s*(\d[\d,]*(?:\.\d+)?)')
+HOLDERS_TEXT_RE = re.compile(r'Holders[:\s]*(\d[\d,]*)')
+# Everything that isn't part of a plain decimal number ($, commas, suffixes, whitespace)
+NON_NUMERIC_RE = re.compile(r'[^\d.]')
+
+# Board page structure (this will need to be updated if pump.fun changes its markup)
+TOKEN_CARD_SELECTOR = '.token-list-item, .token-card, [data-token-address]'
+CARD_NAME_SELECTOR = '.token-name, h3, .name'
+CARD_MARKET_CAP_SELECTOR = '.market-cap, .cap'
+CARD_DESCRIPTION_SELECTOR = '.description, .token-description'
+
+# Token page structure; each group is matched in a single tree walk, first match in document order wins
+TOKEN_NAME_SELECTOR = 'h1, h2.token-name, .token-name, .token-header h1'
+TOKEN_MARKET_CAP_SELECTOR = '.market-cap, .token-market-cap, .stats-value'
+TOKEN_DESCRIPTION_SELECTOR = '.whitespace-pre-wrap, .token-description, .description, p.description'
+TOKEN_IMAGE_SELECTOR = '.token-image, .coin-image, .token-logo'
 
-# Define headers globally with more browser-like headers to avoid being blocked
-headers = {
+# Browser-like headers to avoid being blocked, set once on the shared session and read-only from then on.
+# Brotli isn't advertised: aiohttp can only decode it with the optional Brotli package installed
+HEADERS = MappingProxyType({
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
     "Accept-Language": "en-US,en;q=0.9",
-    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Encoding": "gzip, deflate",
     "Connection": "keep-alive",
     "Upgrade-Insecure-Requests": "1",
     "Cache-Control": "max-age=0"
-}
+})
 
-# Define timeout and retry settings
+# Define timeout settings
 TIMEOUT = ClientTimeout(total=30, connect=10, sock_read=10)
-MAX_RETRIES = 5  # Increased from 3 to 5
-INITIAL_RETRY_DELAY = 1
 
-async def fetch_with_retry(session, url, params):
-    """Helper function to fetch data with exponential backoff retry logic"""
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.info(f"Attempt {attempt + 1}/{MAX_RETRIES} for URL: {url}")
-            async with session.get(url, params=params, headers=headers, timeout=TIMEOUT) as response:
-                if response.status == 429:  # Rate limit
-                    retry_after = int(response.headers.get('Retry-After', INITIAL_RETRY_DELAY * (2 ** attempt)))
-                    logger.warning(f"Rate limited, waiting {retry_after} seconds (attempt {attempt + 1}/{MAX_RETRIES})")
-                    await asyncio.sleep(retry_after)
-                    continue
-                
-                if response.status == 503 or response.status == 502:  # Service Unavailable or Bad Gateway
-                    retry_delay = INITIAL_RETRY_DELAY * (2 ** attempt)
-                    logger.warning(f"Service unavailable (status: {response.status}), retrying in {retry_delay} seconds")
-                    await asyncio.sleep(retry_delay)
-                    continue
-                
-                if response.status != 200:
-                    logger.error(f"HTTP error: {response.status} for URL: {url}")
-                    if attempt == MAX_RETRIES - 1:
-                        return None  # Return None instead of raising exception to allow fallbacks
-                    await asyncio.sleep(INITIAL_RETRY_DELAY * (2 ** attempt))
-                    continue
-                
-                return await response.json()
-                
-        except asyncio.TimeoutError:
-            retry_delay = INITIAL_RETRY_DELAY * (2 ** attempt)  # Exponential backoff
-            logger.warning(f"Timeout on attempt {attempt + 1}/{MAX_RETRIES}, waiting {retry_delay} seconds")
-            if attempt == MAX_RETRIES - 1:
-                return None  # Return None instead of raising exception to allow fallbacks
-            await asyncio.sleep(retry_delay)
-            
-        except ClientError as e:
-            retry_delay = INITIAL_RETRY_DELAY * (2 ** attempt)  # Exponential backoff
-            logger.error(f"Network error on attempt {attempt + 1}/{MAX_RETRIES}: {str(e)}")
-            if attempt == MAX_RETRIES - 1:
-                return None  # Return None instead of raising exception to allow fallbacks
-            await asyncio.sleep(retry_delay)
-            
-        except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
-            if attempt == MAX_RETRIES - 1:
-                return None
-            await asyncio.sleep(INITIAL_RETRY_DELAY * (2 ** attempt))
-    
-    return None  # Return None if all attempts failed
+# Cap in-flight upstream requests at what the connector can serve per host, so bursts
+# queue here instead of piling up inside the connection pool
+MAX_CONCURRENT_REQUESTS = 16
+request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+# Token page scrapes in progress, keyed by address, so concurrent lookups share one upstream request
+token_inflight: Dict[str, asyncio.Task] = {}
+
+# Threads used for CPU-bound HTML parsing
+PARSE_WORKERS = 4
+
+@app.on_event("startup")
+async def startup():
+    """Create the app-lifetime HTTP session so keep-alive connections are reused across requests"""
+    # Small dedicated pool for HTML parsing handed off from the event loop
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=PARSE_WORKERS))
+    app.state.session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=64, limit_per_host=MAX_CONCURRENT_REQUESTS, ttl_dns_cache=300, keepalive_timeout=75),
+        timeout=TIMEOUT,
+        headers=HEADERS
+    )
+    # Scraped /token/{token_address} responses, plus addresses the site answered 404 for
+    app.state.token_details_cache = TTLCache(maxsize=TOKEN_DETAILS_CACHE_SIZE, ttl=TOKEN_DETAILS_DURATION)
+    app.state.token_not_found_cache = TTLCache(maxsize=TOKEN_DETAILS_CACHE_SIZE, ttl=TOKEN_NOT_FOUND_DURATION)
+    app.state.redis = None
+    if REDIS_URL:
+        if aioredis is None:
+            logger.warning("REDIS_URL is set but the redis package is not installed, caching per worker only")
+        else:
+            app.state.redis = aioredis.from_url(
+                REDIS_URL,
+                socket_timeout=REDIS_TIMEOUT,
+                socket_connect_timeout=REDIS_TIMEOUT
+            )
+    # Keep the token list warm so requests are served from cache instead of waiting on pump.fun
+    app.state.stop_refresher = asyncio.Event()
+    app.state.refresher = asyncio.create_task(keep_tokens_warm(app.state.session, app.state.stop_refresher))
 
-async def fetch_tokens(limit: int = 100, force_refresh: bool = False):
-    """Fetch tokens by scraping pump.fun website directly"""
-    current_time = datetime.now()
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the background refresher, then close the shared HTTP session and its connection pool"""
+    # The event also ends the loop should a client library swallow the cancellation mid-request
+    app.state.stop_refresher.set()
+    app.state.refresher.cancel()
+    try:
+        await app.state.refresher
+    except asyncio.CancelledError:
+        pass
+    await app.state.session.close()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+
+async def fetch_tokens(session: aiohttp.ClientSession, limit: int = 100, force_refresh: bool = False) -> None:
+    """Make sure the cache holds tokens for `limit`, refreshing them from pump.fun with at most one scrape in flight"""
+    now = time.monotonic()
     
     # Return cached data if available and not expired
-    if not force_refresh and token_cache["data"] is not None:
-        cache_age = (current_time - token_cache["last_updated"]).total_seconds()
-        if cache_age < CACHE_DURATION:
-            logger.info("Returning cached token data")
-            return token_cache["data"][:limit]
+    if not force_refresh and token_cache.is_fresh(limit, now):
+        return
     
-    try:
-        logger.info(f"Scraping tokens from pump.fun website")
-        
-        # Use direct HTTP request instead of aiohttp for better compatibility with some sites
-        url = f"{WEBSITE_URL}/board"
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch tokens, status code: {response.status_code}")
-            # Try to use cached data as fallback
-            if token_cache["data"] is not None:
-                cache_age = (current_time - token_cache["last_updated"]).total_seconds()
-                if cache_age > CACHE_FALLBACK_DURATION:
-                    logger.warning(f"Cached data is too old ({cache_age} seconds), but using anyway as fallback")
-                logger.info("Using cached data as fallback")
-                return token_cache["data"][:limit]
-            else:
-                raise HTTPException(status_code=503, detail="Service unavailable - please try again later")
-        
-        # Parse the HTML
-        soup = BeautifulSoup(response.text, 'lxml')
-        
-        # Find the token list (this will need to be updated based on actual HTML structure)
-        tokens_data = []
-        token_elements = soup.select('.token-list-item, .token-card, [data-token-address]')
-        
-        logger.info(f"Found {len(token_elements)} token elements on the page")
-        
-        for element in token_elements[:limit]:  # Only process up to the limit
-            try:
-                # Extract token data based on HTML structure
-                token_address = element.get('data-token-address') or element.get('href', '').split('/')[-1]
-                
-                if not token_address or token_address == '#':
-                    continue
-                
-                # Get token name
-                name_elem = element.select_one('.token-name, h3, .name')
-                name = name_elem.text.strip() if name_elem else token_address
-                
-                # Try to find market cap
-                market_cap_elem = element.select_one('.market-cap, .cap')
-                market_cap = 0
-                if market_cap_elem:
-                    market_cap_text = market_cap_elem.text.strip()
-                    # Extract just the numeric part, removing $, commas, etc.
-                    market_cap_text = re.sub(r'[^\d.]', '', market_cap_text)
-                    try:
-                        market_cap = float(market_cap_text)
-                    except ValueError:
-                        pass
-                
-                # Calculate price (1 billion supply)
-                price = round(market_cap / 1_000_000_000, 8) if market_cap > 0 else 0
-                
-                # Get image URL
-                img_elem = element.select_one('img')
-                image_url = img_elem['src'] if img_elem and 'src' in img_elem.attrs else ""
-                
-                # Get description if available
-                desc_elem = element.select_one('.description, .token-description')
-                description = desc_elem.text.strip() if desc_elem else ""
-                
-                tokens_data.append({
-                    "name": name,
-                    "price": price,
-                    "market_cap": market_cap,
-                    "description": description,
-                    "image_url": image_url,
-                    "token_url": f"{WEBSITE_URL}/board/{token_address}",
-                    "mint": token_address,
-                    "supply": "1,000,000,000",
-                    "replies": 0  # We don't have this information from scraping
-                })
-            except Exception as e:
-                logger.error(f"Error processing token element: {str(e)}")
-                continue
-        
-        logger.info(f"Successfully scraped {len(tokens_data)} tokens")
-        
-        # Update cache
-        token_cache["data"] = tokens_data
-        token_cache["last_updated"] = current_time
-        
-        return tokens_data[:limit]
+    while True:
+        async with token_cache.lock:
+            refresh_in_flight = not token_cache.refreshing.is_set()
+            # Stale but not too old: answer right away and let the refresh happen in the background
+            serve_stale = (
+                not force_refresh
+                and token_cache.covers(limit)
+                and now - token_cache.last_updated < CACHE_FALLBACK_DURATION
+            )
+            if not refresh_in_flight:
+                # Re-check now that we hold the lock, a refresh may have just completed
+                if not force_refresh and token_cache.is_fresh(limit, now):
+                    return
+                token_cache.refreshing.clear()
+                # Scrape at least what the refresher keeps warm, so every cached request stays a slice
+                scrape_limit = max(limit, WARM_LIMIT)
+                if serve_stale:
+                    logger.info("Serving stale token data while refreshing in the background")
+                    token_cache.refresh_task = asyncio.create_task(refresh_tokens_in_background(session, scrape_limit))
+                    return
+                break
+            if serve_stale:
+                return
         
+        logger.debug("Token refresh already in flight, waiting for it")
+        await token_cache.refreshing.wait()
+        if token_cache.data is None:
+            raise HTTPException(status_code=503, detail="Service unavailable - please try again later")
+        if limit <= token_cache.max_limit:
+            return
+        # Every scrape covers WARM_LIMIT, so this only happens when the refresh we waited on failed
+        # and left the smaller shared fallback copy in the cache; try a refresh of our own
+        force_refresh = False
+    
+    try:
+        await refresh_tokens(session, scrape_limit, force_refresh)
     except Exception as e:
-        logger.error(f"Error fetching tokens: {str(e)}\n{traceback.format_exc()}")
+        logger.error("Error fetching tokens: %s", e, exc_info=True)
         
         # Fallback to cached data if available
-        if token_cache["data"] is not None:
+        if token_cache.data is not None:
             logger.info("Using cached data as fallback due to error")
             
             # Check if cached data is too old (beyond fallback duration)
-            cache_age = (current_time - token_cache["last_updated"]).total_seconds()
+            cache_age = time.monotonic() - token_cache.last_updated
             if cache_age > CACHE_FALLBACK_DURATION:
-                logger.warning(f"Cached data is too old ({cache_age} seconds), but using anyway as fallback")
+                logger.warning("Cached data is too old (%s seconds), but using anyway as fallback", cache_age)
                 
-            return token_cache["data"][:limit]
+            return
                 
         raise HTTPException(status_code=503, detail="Service unavailable - please try again later")
 
-@app.get("/tokens")
-async def get_tokens(limit: Optional[int] = 100, force_refresh: Optional[bool] = False):
+async def refresh_tokens(
+    session: aiohttp.ClientSession,
+    limit: int,
+    force_refresh: bool = False,
+    max_shared_age: Optional[float] = None,
+    claim_scrape: bool = False
+) -> None:
+    """Scrape the board into the cache, then wake everyone waiting on the refresh.
+    `max_shared_age` bounds how old a copy shared by another worker may be to be used instead;
+    with `claim_scrape`, skip scraping when another worker holds the shared scrape lock"""
+    try:
+        # Another worker may have scraped the board already
+        if not force_refresh and await load_shared_tokens(REDIS_TOKENS_KEY, limit, max_shared_age):
+            return
+        # Only skip when there is something to serve meanwhile; the lock holder publishes its result
+        if claim_scrape and token_cache.data is not None and not await claim_shared_scrape():
+            logger.debug("Another worker is scraping the board, picking up its result later")
+            return
+        await scrape_tokens(session, limit)
+    except Exception:
+        # Nothing to serve in this worker yet: take the long-lived shared copy before waking the waiters
+        if token_cache.data is None:
+            await load_shared_tokens(REDIS_TOKENS_FALLBACK_KEY, 0)
+        raise
+    finally:
+        token_cache.refreshing.set()
+
+async def refresh_tokens_in_background(session: aiohttp.ClientSession, limit: int):
+    """Stale-while-revalidate refresh; on failure the stale data simply stays in place"""
+    try:
+        await refresh_tokens(session, limit)
+    except Exception as e:
+        logger.warning("Background token refresh failed, keeping stale data: %s", e)
+
+async def keep_tokens_warm(session: aiohttp.ClientSession, stop: asyncio.Event):
+    """Re-scrape the board shortly before the cached list expires, until `stop` is set"""
+    refresh_at_age = CACHE_DURATION - REFRESH_AHEAD
+    while not stop.is_set():
+        age = time.monotonic() - token_cache.last_updated
+        if not token_cache.covers(WARM_LIMIT) or age >= refresh_at_age:
+            async with token_cache.lock:
+                # Join the single-flight refresh rather than starting a second one
+                start_refresh = token_cache.refreshing.is_set()
+                if start_refresh:
+                    token_cache.refreshing.clear()
+            if not start_refresh:
+                # A request is refreshing already, re-check once it's done (it may not cover WARM_LIMIT)
+                await token_cache.refreshing.wait()
+                continue
+            try:
+                # Shared copies must leave time to spare, otherwise every worker reloads the same
+                # nearly expired list and then scrapes once it expires
+                await refresh_tokens(session, WARM_LIMIT, max_shared_age=refresh_at_age, claim_scrape=True)
+            except Exception as e:
+                logger.warning("Scheduled token refresh failed: %s", e)
+            age = time.monotonic() - token_cache.last_updated
+        
+        # Sleep until the list actually cached here is due, never less than the retry delay
+        delay = max(refresh_at_age - age, REFRESH_RETRY_DELAY) + random.uniform(0, REFRESH_JITTER)
+        try:
+            await asyncio.wait_for(stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+async def read_shared(key: str) -> Optional[bytes]:
+    """GET `key` from Redis; None when Redis is off, unreachable or doesn't have it"""
+    if app.state.redis is None:
+        return None
+    try:
+        return await app.state.redis.get(key)
+    except aioredis.RedisError as e:
+        logger.warning("Could not read %s from Redis: %s", key, e)
+        return None
+
+async def write_shared(blob: bytes, expirations: Dict[str, int]):
+    """SET `blob` under every key in `expirations`, each expiring after its number of seconds"""
+    if app.state.redis is None:
+        return
+    try:
+        async with app.state.redis.pipeline(transaction=False) as pipe:
+            for key, seconds in expirations.items():
+                pipe.set(key, blob, ex=seconds)
+            await pipe.execute()
+    except aioredis.RedisError as e:
+        logger.warning("Could not write %s to Redis: %s", ", ".join(expirations), e)
+
+async def claim_shared_scrape() -> bool:
+    """Take the cross-worker scrape lock; True when this worker should scrape (always, without Redis)"""
+    if app.state.redis is None:
+        return True
+    try:
+        return bool(await app.state.redis.set(REDIS_TOKENS_LOCK_KEY, b"1", nx=True, ex=REFRESH_AHEAD))
+    except aioredis.RedisError as e:
+        logger.warning("Could not take the scrape lock in Redis: %s", e)
+        return True
+
+async def load_shared_tokens(key: str, limit: int, max_age: Optional[float] = None) -> bool:
+    """Load the token list stored under `key` in Redis into token_cache if it covers `limit`
+    and, when `max_age` is given, was scraped less than `max_age` seconds ago"""
+    blob = await read_shared(key)
+    if blob is None:
+        return False
+    
+    shared = orjson.loads(blob)
+    if shared["limit"] < limit:
+        return False
+    if max_age is not None and time.time() - shared["scraped_at"] >= max_age:
+        return False
+    token_cache.store([TokenRow(**row) for row in shared["tokens"]], shared["limit"], shared["etag"])
+    # Age the local copy by when it was scraped, so every worker expires it together. Monotonic clocks
+    # aren't comparable across processes, hence the wall-clock timestamp
+    token_cache.last_updated -= max(time.time() - shared["scraped_at"], 0)
+    return True
+
+async def save_shared_tokens():
+    """Publish token_cache to Redis for the other workers"""
+    if app.state.redis is None:
+        return
+    scraped_at = time.time() - (time.monotonic() - token_cache.last_updated)
+    blob = orjson.dumps({
+        "limit": token_cache.max_limit,
+        "etag": token_cache.etag,
+        "scraped_at": scraped_at,
+        "tokens": token_cache.data
+    })
+    await write_shared(blob, {REDIS_TOKENS_KEY: CACHE_DURATION, REDIS_TOKENS_FALLBACK_KEY: CACHE_FALLBACK_DURATION})
+
+def parse_board(html: bytes, limit: int) -> List[TokenRow]:
+    """Extract up to `limit` tokens from the board HTML (CPU-bound, run in the executor)"""
+    # Parse the HTML
+    tree = LexborHTMLParser(html)
+    
+    # Find the token cards
+    # Lexbor returns a node once per selector it matches; key by node identity to keep each card once, in order
+    token_elements = list({element.mem_id: element for element in tree.css(TOKEN_CARD_SELECTOR)}.values())
+    
+    logger.info("Found %d token elements on the page", len(token_elements))
+    
+    # Rows can't outnumber the cards or the limit, so size the list once up front and trim at the end
+    tokens_data = [None] * min(limit, len(token_elements))
+    token_url_prefix = TOKEN_URL_PREFIX
+    strip_non_numeric = NON_NUMERIC_RE.sub
+    fetched = 0
+    
+    for element in token_elements:
+        try:
+            # Extract token data based on HTML structure, reading the attribute dict directly
+            attrs = element.attributes
+            token_address = attrs.get('data-token-address') or (attrs.get('href') or '').split('/')[-1]
+            
+            if not token_address or token_address == '#':
+                continue
+            
+            # Get token name
+            name_elem = element.css_first(CARD_NAME_SELECTOR)
+            name = name_elem.text().strip() if name_elem else token_address
+            
+            # Try to find market cap
+            market_cap_elem = element.css_first(CARD_MARKET_CAP_SELECTOR)
+            market_cap = 0
+            if market_cap_elem:
+                # Extract just the numeric part, removing $, commas, whitespace, etc.
+                market_cap_text = strip_non_numeric('', market_cap_elem.text())
+                try:
+                    market_cap = float(market_cap_text)
+                except ValueError:
+                    pass
+            
+            # Calculate price (1 billion supply)
+            price = round(market_cap / 1_000_000_000, 8) if market_cap > 0 else 0
+            
+            # Get image URL
+            img_elem = element.css_first('img')
+            image_url = (img_elem.attributes.get('src') or "") if img_elem else ""
+            
+            # Get description if available
+            desc_elem = element.css_first(CARD_DESCRIPTION_SELECTOR)
+            description = desc_elem.text().strip() if desc_elem else ""
+            
+            tokens_data[fetched] = TokenRow(
+                name=name,
+                price=price,
+                market_cap=market_cap,
+                description=description,
+                image_url=image_url,
+                token_url=token_url_prefix + token_address,
+                mint=token_address
+            )
+            # Count emitted rows rather than visited elements so skipped cards don't shrink the result
+            fetched += 1
+            if fetched >= limit:
+                break
+        except Exception as e:
+            logger.error("Error processing token element: %s", e)
+            continue
+    
+    del tokens_data[fetched:]
+    return tokens_data
+
+async def scrape_tokens(session: aiohttp.ClientSession, limit: int) -> None:
+    """Scrape tokens from the pump.fun board and store them in the cache"""
+    logger.info("Scraping tokens from pump.fun website")
+    
+    # Revalidate instead of re-downloading when the cached scrape already covers this limit
+    request_headers = None
+    if token_cache.etag and token_cache.covers(limit):
+        request_headers = {"If-None-Match": token_cache.etag}
+    
+    # Go through the shared session so the connection to pump.fun stays warm between calls
+    async with request_semaphore, session.get(BOARD_URL, headers=request_headers) as response:
+        status_code = response.status
+        etag = response.headers.get("ETag")
+        # Raw bytes go straight to Lexbor, which parses UTF-8 natively
+        html = await response.read() if status_code == 200 else b""
+    
+    if status_code == 304:
+        logger.info("Board unchanged since last scrape, keeping cached tokens")
+        token_cache.last_updated = time.monotonic()
+        await save_shared_tokens()
+        return
+    
+    if status_code != 200:
+        logger.error("Failed to fetch tokens, status code: %s", status_code)
+        raise HTTPException(status_code=503, detail="Service unavailable - please try again later")
+    
+    # Parsing is pure CPU work, keep it off the event loop so other requests keep flowing
+    tokens_data = await asyncio.get_running_loop().run_in_executor(None, parse_board, html, limit)
+    
+    logger.info("Successfully scraped %d tokens", len(tokens_data))
+    
+    # Update cache
+    token_cache.store(tokens_data, limit, etag)
+    await save_shared_tokens()
+
+@app.get("/tokens", response_model=None)
+async def get_tokens(request: Request, limit: Optional[int] = 100, force_refresh: Optional[bool] = False):
     """Get list of top tokens from pump.fun, sorted by market cap"""
     try:
         if not 1 <= limit <= 1000:
             raise HTTPException(status_code=400, detail="Limit must be between 1 and 1000")
             
-        tokens = await fetch_tokens(limit, force_refresh)
-        return JSONResponse(content=tokens)
+        await fetch_tokens(app.state.session, limit, force_refresh)
+        
+        # The cache now covers this limit, so send its encoded bytes instead of re-encoding
+        payload = token_cache.payload(limit)
+        if len(payload) >= GZIP_MINIMUM_SIZE and "gzip" in request.headers.get("Accept-Encoding", ""):
+            return Response(
+                content=token_cache.gzipped_payload(limit),
+                media_type="application/json",
+                headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+            )
+        return Response(content=payload, media_type="application/json")
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error in get_tokens: {str(e)}\n{traceback.format_exc()}")
+        logger.error("Error in get_tokens: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error"
         )
 
-@app.get("/token/{token_address}")
+def parse_token_page(html: bytes, token_address: str, url: str) -> Dict:
+    """Parse a token page into the /token/{token_address} response"""
+    tree = LexborHTMLParser(html)
+    
+    # Debug the HTML structure, only looked up when debug records are actually emitted
+    if logger.isEnabledFor(logging.DEBUG):
+        title_elem = tree.css_first('title')
+        logger.debug("Page title: %s", title_elem.text() if title_elem else 'No title found')
+    
+    # Try to find token name (various selectors to increase chances)
+    name_elem = tree.css_first(TOKEN_NAME_SELECTOR)
+    
+    name = name_elem.text().strip() if name_elem else token_address
+    logger.debug("Found token name: %s", name)
+    
+    # Market cap and holders are labelled values. Scan the raw HTML with compiled regexes first,
+    # and only materialise the page text for a second attempt when that misses
+    market_cap_match = MARKET_CAP_HTML_RE.search(html)
+    holders_match = HOLDERS_HTML_RE.search(html)
+    # Raw-HTML matches are bytes; the captured digits are ASCII
+    market_cap_value = market_cap_match.group(1).decode() if market_cap_match else None
+    holders_value = holders_match.group(1).decode() if holders_match else None
+    if market_cap_value is None or holders_value is None:
+        page_text = tree.body.text(separator=' ') if tree.body else ""
+        if market_cap_value is None:
+            market_cap_match = MARKET_CAP_TEXT_RE.search(page_text)
+            market_cap_value = market_cap_match.group(1) if market_cap_match else None
+        if holders_value is None:
+            holders_match = HOLDERS_TEXT_RE.search(page_text)
+            holders_value = holders_match.group(1) if holders_match else None
+    
+    # Find market cap using multiple approaches
+    market_cap = 0
+    market_cap_text = None
+    
+    # Approach 1: Look for the value following "Market Cap"
+    if market_cap_value:
+        # The regexes only capture digits, commas and dots, so dropping the commas is enough
+        market_cap_text = market_cap_value.replace(',', '')
+    else:
+        # Approach 2: Look for specific classes or patterns
+        market_cap_elem = tree.css_first(TOKEN_MARKET_CAP_SELECTOR)
+        if market_cap_elem:
+            # Free-form element text, extract just the numeric part, removing $, commas, etc.
+            market_cap_text = NON_NUMERIC_RE.sub('', market_cap_elem.text())
+    
+    if market_cap_text:
+        try:
+            market_cap = float(market_cap_text)
+            logger.debug("Found market cap: $%s", market_cap)
+        except ValueError:
+            logger.warning("Could not parse market cap: %s", market_cap_text)
+    
+    # Calculate price from market cap
+    price = round(market_cap / 1_000_000_000, 8) if market_cap > 0 else 0
+    
+    # Get description
+    desc_elem = tree.css_first(TOKEN_DESCRIPTION_SELECTOR)
+    
+    description = desc_elem.text().strip() if desc_elem else ""
+    
+    # Get image - try multiple approaches
+    image_url = ""
+    # Try to find image by alt text
+    img_elem = next((img for img in tree.css('img') if img.attributes.get('alt') == name), None) if name else None
+    if img_elem:
+        image_url = img_elem.attributes.get('src') or ""
+    
+    # If not found, try common image classes
+    if not image_url:
+        img_elem = tree.css_first(TOKEN_IMAGE_SELECTOR)
+        if img_elem:
+            image_url = img_elem.attributes.get('src') or ""
+    
+    # Get holders count
+    holders = 0
+    if holders_value:
+        try:
+            holders = int(holders_value.replace(',', ''))
+        except ValueError:
+            pass
+    
+    token_info = {
+        "name": name,
+        "price": price,
+        "market_cap": market_cap,
+        "description": description,
+        "image_url": image_url,
+        "token_url": url,
+        "mint": token_address,
+        "supply": "1,000,000,000",
+        "holders": holders
+    }
+    
+    return token_info
+
+async def scrape_token(session: aiohttp.ClientSession, token_address: str) -> Tuple[bytes, bool]:
+    """Scrape one token's page into encoded JSON, caching it (or a 404) for later lookups.
+    Returns the payload and whether it is a stale copy served because pump.fun failed"""
+    # Another worker may have scraped this token recently
+    payload = await read_shared(REDIS_TOKEN_KEY_PREFIX + token_address)
+    if payload is not None:
+        app.state.token_details_cache[token_address] = payload
+        return payload, False
+    
+    url = TOKEN_URL_PREFIX + token_address
+    logger.info("Fetching token data from: %s", url)
+    
+    try:
+        # Non-blocking fetch over the shared keep-alive session, the loop keeps serving other requests meanwhile.
+        # Keep the body as raw UTF-8 bytes: Lexbor and the regexes read them directly, with no str decode
+        async with request_semaphore, session.get(url) as response:
+            status_code = response.status
+            html = await response.read() if status_code == 200 else b""
+        
+        if status_code == 200:
+            # Parsing is pure CPU work, keep it off the event loop so other requests keep flowing
+            token_info = await asyncio.get_running_loop().run_in_executor(None, parse_token_page, html, token_address, url)
+            
+            logger.info("Successfully scraped token: %s", token_info["name"])
+            payload = orjson.dumps(token_info)
+            app.state.token_details_cache[token_address] = payload
+            await write_shared(payload, {
+                REDIS_TOKEN_KEY_PREFIX + token_address: TOKEN_DETAILS_DURATION,
+                REDIS_TOKEN_FALLBACK_KEY_PREFIX + token_address: CACHE_FALLBACK_DURATION
+            })
+            return payload, False
+        elif status_code == 404:
+            app.state.token_not_found_cache[token_address] = True
+            raise HTTPException(status_code=404, detail=f"Token not found: {token_address}")
+        else:
+            logger.error("HTTP error when fetching token: %s", status_code)
+            error = HTTPException(
+                status_code=status_code,
+                detail=f"Error fetching token data, status code: {status_code}"
+            )
+    except (ClientError, asyncio.TimeoutError) as e:
+        logger.error("Request error when fetching token: %s", e)
+        error = HTTPException(status_code=503, detail="Service unavailable - please try again later")
+    
+    # pump.fun is failing, fall back on the last copy any worker scraped
+    payload = await read_shared(REDIS_TOKEN_FALLBACK_KEY_PREFIX + token_address)
+    if payload is None:
+        raise error
+    logger.warning("Serving stale data for token %s", token_address)
+    return payload, True
+
+@app.get("/token/{token_address}", response_model=None)
 async def get_token(token_address: str):
     """Get specific token details by address"""
     try:
-        # Directly scrape the token's page
-        url = f"https://pump.fun/board/{token_address}"
-        logger.info(f"Fetching token data from: {url}")
+        # First try the recently scraped token pages, then the cached board list
+        # Responses are sent as ready-made JSON bytes, skipping FastAPI's jsonable_encoder pass
+        payload = app.state.token_details_cache.get(token_address)
+        if payload is not None:
+            return Response(content=payload, media_type="application/json")
         
-        # First try to get from cached tokens
-        if token_cache["data"] is not None:
-            for token in token_cache["data"]:
-                if token["token_url"].endswith(token_address):
-                    logger.info(f"Found token in cache: {token['name']}")
-                    return token
+        token = token_cache.by_mint.get(token_address)
+        if token is not None:
+            return Response(content=orjson.dumps(token), media_type="application/json")
         
-        # If not in cache, scrape the website
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml",
-            "Accept-Language": "en-US,en;q=0.9",
-        }
+        # Checked after the board list, which wins once a token whose page was missing shows up there
+        if token_address in app.state.token_not_found_cache:
+            raise HTTPException(status_code=404, detail=f"Token not found: {token_address}")
         
-        try:
-            response = requests.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                logger.info("Successfully fetched token page")
-                html = response.text
-                soup = BeautifulSoup(html, 'lxml')
-                
-                # Debug the HTML structure
-                logger.debug(f"Page title: {soup.title.string if soup.title else 'No title found'}")
-                
-                # Try to find token name (various selectors to increase chances)
-                name_elem = None
-                for selector in ['h1', 'h2.token-name', '.token-name', '.token-header h1']:
-                    if name_elem:
-                        break
-                    name_elem = soup.select_one(selector)
-                
-                name = name_elem.text.strip() if name_elem else token_address
-                logger.info(f"Found token name: {name}")
-                
-                # Find market cap using multiple approaches
-                market_cap = 0
-                market_cap_elem = None
-                
-                # Approach 1: Look for text containing "Market Cap"
-                for div in soup.find_all(['div', 'span', 'p']):
-                    if div.text and 'Market Cap' in div.text:
-                        # Look for the nearest element with a dollar value
-                        for sibling in div.find_next_siblings():
-                            if '$' in sibling.text:
-                                market_cap_elem = sibling
-                                break
-                        if market_cap_elem:
-                            break
-                
-                # Approach 2: Look for specific classes or patterns
-                if not market_cap_elem:
-                    market_cap_elem = soup.select_one('.market-cap, .token-market-cap, .stats-value')
-                
-                if market_cap_elem:
-                    market_cap_text = market_cap_elem.text.strip()
-                    # Extract just the numeric part, removing $, commas, etc.
-                    market_cap_text = re.sub(r'[^\d.]', '', market_cap_text)
-                    try:
-                        market_cap = float(market_cap_text)
-                        logger.info(f"Found market cap: ${market_cap}")
-                    except ValueError:
-                        logger.warning(f"Could not parse market cap: {market_cap_text}")
-                
-                # Calculate price from market cap
-                price = round(market_cap / 1_000_000_000, 8) if market_cap > 0 else 0
-                
-                # Get description
-                desc_elem = None
-                for selector in ['.whitespace-pre-wrap', '.token-description', '.description', 'p.description']:
-                    if desc_elem:
-                        break
-                    desc_elem = soup.select_one(selector)
-                
-                description = desc_elem.text.strip() if desc_elem else ""
-                
-                # Get image - try multiple approaches
-                image_url = ""
-                # Try to find image by alt text
-                img_elem = soup.find('img', {'alt': name}) if name else None
-                if img_elem and 'src' in img_elem.attrs:
-                    image_url = img_elem['src']
-                
-                # If not found, try common image classes
-                if not image_url:
-                    img_elem = soup.select_one('.token-image, .coin-image, .token-logo')
-                    if img_elem and 'src' in img_elem.attrs:
-                        image_url = img_elem['src']
-                
-                # Get holders count
-                holders = 0
-                holders_elem = None
-                
-                for div in soup.find_all(['div', 'span', 'p']):
-                    if div.text and 'Holders' in div.text:
-                        for sibling in div.find_next_siblings():
-                            if sibling.text and sibling.text.strip().isdigit():
-                                holders_elem = sibling
-                                break
-                        if not holders_elem:
-                            # The number might be in the same element
-                            text = div.text.strip()
-                            matches = re.search(r'Holders[:\s]*([0-9,]+)', text)
-                            if matches:
-                                try:
-                                    holders = int(matches.group(1).replace(',', ''))
-                                except ValueError:
-                                    pass
-                        break
-                
-                if holders_elem:
-                    try:
-                        holders = int(holders_elem.text.strip().replace(',', ''))
-                    except ValueError:
-                        pass
-                
-                token_info = {
-                    "name": name,
-                    "price": price,
-                    "market_cap": market_cap,
-                    "description": description,
-                    "image_url": image_url,
-                    "token_url": url,
-                    "mint": token_address,
-                    "supply": "1,000,000,000",
-                    "holders": holders
-                }
-                
-                logger.info(f"Successfully scraped token: {name}")
-                return token_info
-            elif response.status_code == 404:
-                raise HTTPException(status_code=404, detail=f"Token not found: {token_address}")
-            else:
-                logger.error(f"HTTP error when fetching token: {response.status_code}")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Error fetching token data, status code: {response.status_code}"
-                )
-        except requests.RequestException as e:
-            logger.error(f"Request error when fetching token: {str(e)}")
-            raise HTTPException(status_code=503, detail="Service unavailable - please try again later")
+        # If not in cache, scrape the website. Concurrent requests for the same address share one scrape
+        task = token_inflight.get(token_address)
+        if task is None:
+            task = asyncio.create_task(scrape_token(app.state.session, token_address))
+            token_inflight[token_address] = task
+            task.add_done_callback(lambda _: token_inflight.pop(token_address, None))
+        
+        # Shielded so one client disconnecting doesn't cancel the scrape others are waiting on
+        payload, stale = await asyncio.shield(task)
+        return Response(
+            content=payload,
+            media_type="application/json",
+            headers={"X-Cache": "stale"} if stale else None
+        )
                     
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching token: {str(e)}\nTraceback: {traceback.format_exc()}")
+        logger.error("Error fetching token: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="An error occurred while fetching token data")
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
-    logger.error(f"Global exception handler caught: {str(exc)}\n{traceback.format_exc()}")
+    logger.error("Global exception handler caught: %s", exc, exc_info=exc)
     
     if isinstance(exc, HTTPException):
         # Pass through HTTP exceptions with their status codes
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=exc.status_code,
             content={"detail": exc.detail}
         )
     
     # For other exceptions, return a generic 500 error
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "The server encountered an unexpected error. Please try again later."}
     )
@@ -424,7 +782,12 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=port,
-        reload=True,
+        # The reloader spawns a file watcher and is only meant for local development
+        reload=os.getenv("DEV") == "1",
+        workers=int(os.getenv("WORKERS", 1)),
+        loop="uvloop",
+        http="httptools",
         timeout_keep_alive=30,
-        access_log=True
+        # Per-request access lines are off by default; ACCESS_LOG=1 turns them back on for debugging
+        access_log=os.getenv("ACCESS_LOG") == "1"
     ) 
\ No newline at end of file